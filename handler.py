@@ -1,5 +1,8 @@
-import json, os, boto3, decimal, time
-from boto3.dynamodb.conditions import  Attr
+import json, os, boto3, decimal, time, threading
+from boto3.dynamodb.conditions import  Attr, Key
+from botocore.exceptions import ClientError
+from boto3.dynamodb.types import TypeDeserializer
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
 from helpers import _get_response 
@@ -9,6 +12,12 @@ from helpers import _empty_strings_to_dash
 from helpers import send_to_datastream
 from helpers import add_item_timestamps
 from helpers import merge_dicts
+from helpers import FRESHNESS_PARTITION
+from helpers import parse_status_fields
+from helpers import build_projection_expression
+from helpers import filter_status_fields
+from helpers import flatten_status
+from helpers import combine_status_entries
 
 """
 TODO:
@@ -25,33 +34,161 @@ try:
 except Exception as e:
     print(e)
 
+try:
+    stream_checkpoint_table = dynamodb.Table(os.getenv('STREAM_CHECKPOINT_TABLE'))
+except Exception as e:
+    print(e)
+
+# Combined site status kept between invocations of a warm lambda, keyed by (site, field paths).
+# Each value is (fingerprint, combined_status), where the fingerprint is built from the server_timestamp_ms
+# of every status entry used, so the status is only reassembled when one of its entries has changed.
+combined_status_cache = {}
+combined_status_cache_lock = threading.Lock()
+COMBINED_STATUS_CACHE_SIZE = 256
+
 # Use local dynamodb if running with serverless-offline
 if os.getenv('IS_OFFLINE'):
     print("In offline development mode: " + os.getenv('IS_OFFLINE'))
     resource = boto3.resource('dynamodb', endpoint_url='http://localhost:9000')
     status_table = resource.Table(name='photonranch-status-dev')
+    stream_checkpoint_table = resource.Table(name='photonranch-status-stream-checkpoints-dev')
+
+
+# Number of sites whose stream records are sent to datastream concurrently
+STREAM_SITE_CONCURRENCY = int(os.getenv('STREAM_SITE_CONCURRENCY', 4))
+
+# The (server_timestamp_ms, SequenceNumber) of the newest status sent to datastream for each (site, statusType)
+# is stored in the stream checkpoint table, so that replayed or out of date records are never sent again, even
+# when a retry runs in a new lambda container. This dict caches the checkpoints in a warm lambda to skip
+# most replayed records without reading the table.
+last_sent_status = {}
+last_sent_status_lock = threading.Lock()
+
+_deserializer = TypeDeserializer()
 
 
 def stream_handler(event, context):
-    """Sends the site status event to datastream."""
-    print(f"size of stream event: {len(event['Records'])}")
-    print(json.dumps(event))
+    """Sends the site status in each stream record to datastream.
+
+    Records for different sites are processed concurrently, while the records of each site are processed in
+    order. Records that fail are reported in batchItemFailures (the stream event uses ReportBatchItemFailures)
+    so that lambda only retries from the first failed record instead of replaying the whole batch.
+
+    Each status that is sent costs one conditional PutItem on the stream checkpoint table, plus one
+    strongly consistent GetItem the first time a container sees that site and status type.
+    """
     records = event.get('Records', [])
-    for item in records:
+    print(f"size of stream event: {len(records)}")
+
+    records_by_site = {}
+    for record in records:
+        site = record['dynamodb']['Keys']['site']['S']
+        records_by_site.setdefault(site, []).append(record)
 
-        site = item['dynamodb']['Keys']['site']['S']
-        status_type = item['dynamodb']['Keys']['statusType']['S']
+    failed_sequence_numbers = []
+    with ThreadPoolExecutor(max_workers=STREAM_SITE_CONCURRENCY) as executor:
+        for failed in executor.map(_process_site_stream_records, records_by_site.values()):
+            failed_sequence_numbers.extend(failed)
 
-        status = get_status(site, status_type)
+    if failed_sequence_numbers:
+        print(f"Failed to process {len(failed_sequence_numbers)} of {len(records)} stream records")
+    return {
+        "batchItemFailures": [{"itemIdentifier": sequence_number} for sequence_number in failed_sequence_numbers]
+    }
 
-        # If the status we fetched doesn't have the key 'status', then there is no data so we should close the handler.
-        if status.get('status', 'not here') == 'not here': 
-            return
 
-        # Send to datastreamer
-        send_to_datastream(site, status) 
+def _process_site_stream_records(records):
+    """Process the stream records of a single site in order.
 
-    return _get_response(200, "stream has activated this function")
+    Returns:
+        list: SequenceNumbers of the records that failed. Processing stops at the first failure, so that
+        record and all later records of the site are reported, keeping the site's statuses in order.
+    """
+    for i, record in enumerate(records):
+        try:
+            _process_stream_record(record)
+        except Exception as e:
+            print(f"Error processing stream record {record['dynamodb'].get('SequenceNumber')}: {e}")
+            return [r['dynamodb']['SequenceNumber'] for r in records[i:]]
+    return []
+
+
+def _process_stream_record(record):
+    """Send the status in a stream record to datastream, unless a newer status has already been sent."""
+    # Deleted entries (eg. from clear_all_site_status) have no status to send
+    new_image = record['dynamodb'].get('NewImage')
+    if record.get('eventName') == 'REMOVE' or new_image is None:
+        return
+
+    status = {key: _deserializer.deserialize(value) for key, value in new_image.items()
+              if key != 'freshness_partition'}
+    if 'status' not in status:
+        return
+
+    # Entries marked stale by the stale status sweeper are reported in its single stale_status message,
+    # so they aren't sent again individually. Any new status from the site clears the flag.
+    if status.get('stale'):
+        return
+
+    site = status['site']
+    status_key = (site, status['statusType'])
+    version = (status.get('server_timestamp_ms', 0), int(record['dynamodb']['SequenceNumber']))
+    if _already_sent(status_key, version):
+        print(f"Skipping stream record {version[1]}: a newer {status_key} status was already sent")
+        return
+
+    send_to_datastream(site, status)
+    _save_stream_checkpoint(status_key, version)
+
+
+def _already_sent(status_key, version):
+    """Check whether this or a newer version of the (site, statusType) status was sent to datastream.
+
+    The checkpoint table is only read when this container has no checkpoint for the status yet. Otherwise
+    the cached checkpoint is used, and _save_stream_checkpoint's conditional put keeps the stored
+    checkpoint from moving backwards. This relies on the cache not being behind the table, which holds
+    unless another container processed the same shard since this one last did.
+    """
+    with last_sent_status_lock:
+        if status_key in last_sent_status:
+            return last_sent_status[status_key] >= version
+
+    site, status_type = status_key
+    checkpoint = stream_checkpoint_table.get_item(
+        Key={"site": site, "statusType": status_type},
+        ConsistentRead=True,
+    ).get("Item")
+    if checkpoint is None:
+        return False
+
+    checkpoint_version = (checkpoint['server_timestamp_ms'], int(checkpoint['sequence_number']))
+    with last_sent_status_lock:
+        last_sent_status[status_key] = max(checkpoint_version, last_sent_status.get(status_key, checkpoint_version))
+    return checkpoint_version >= version
+
+
+def _save_stream_checkpoint(status_key, version):
+    """Record the version of a status sent to datastream, unless a newer version is already recorded."""
+    with last_sent_status_lock:
+        last_sent_status[status_key] = max(version, last_sent_status.get(status_key, version))
+
+    site, status_type = status_key
+    server_timestamp_ms, sequence_number = version
+    try:
+        stream_checkpoint_table.put_item(
+            Item={
+                "site": site,
+                "statusType": status_type,
+                "server_timestamp_ms": server_timestamp_ms,
+                "sequence_number": sequence_number,
+            },
+            ConditionExpression=Attr('site').not_exists()
+                | Attr('server_timestamp_ms').lt(server_timestamp_ms)
+                | (Attr('server_timestamp_ms').eq(server_timestamp_ms) & Attr('sequence_number').lt(sequence_number)),
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
 
 
 #=========================================#
@@ -96,6 +233,7 @@ def post_status(site, status_type, new_status):
         "statusType": status_type,
         "status": merged_status,
         "server_timestamp_ms": server_timestamp_ms,
+        "freshness_partition": FRESHNESS_PARTITION,
     }
     dynamodb_entry = _empty_strings_to_dash(entry)
 
@@ -164,32 +302,71 @@ def post_forecast_status(site, status_type, new_status):
     table_response = status_table.put_item(Item=dynamodb_entry)
     return table_response
 
-def get_status(site, status_type):
-    """Retrieves status from table for a given site and status type."""
-    table_response = status_table.get_item(Key={"site": site, "statusType": status_type})
-    return table_response.get("Item", {})
+def get_status(site, status_type, field_paths=None):
+    """Retrieves status from table for a given site and status type.
 
+    If field_paths (see helpers.parse_status_fields) are given, only those parts of the status are read.
+    """
+    get_args = {"Key": {"site": site, "statusType": status_type}}
+    if field_paths:
+        get_args["ProjectionExpression"], get_args["ExpressionAttributeNames"] = build_projection_expression(field_paths)
+    table_response = status_table.get_item(**get_args)
+    item = table_response.get("Item", {})
+    # The freshness index attribute is internal, so it isn't returned to clients
+    item.pop("freshness_partition", None)
+    return item
+
+
+def get_combined_site_status(site, field_paths=None):
+    """Retrieves and combines status of all status types (weather, enclosure, device) for a given site.
+
+    When more than one status type reports the same device type, the newest value of each key is used
+    (see helpers.combine_status_entries). If field_paths (see helpers.parse_status_fields) are given, only
+    those parts of the status are read.
+    """
+    query_args = {"KeyConditionExpression": Key('site').eq(site)}
+    if field_paths:
+        query_args["ProjectionExpression"], query_args["ExpressionAttributeNames"] = build_projection_expression(field_paths)
+    all_status_entries = []
+    while True:
+        response = status_table.query(**query_args)
+        all_status_entries.extend(response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            break
+        query_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    cache_key = (site, tuple(tuple(keys) for keys in field_paths or []))
+    fingerprint = tuple(sorted((item.get('statusType'), item.get('server_timestamp_ms')) for item in all_status_entries))
+    with combined_status_cache_lock:
+        cached = combined_status_cache.get(cache_key)
+    if cached is not None and cached[0] == fingerprint:
+        return dict(cached[1])
 
-def get_combined_site_status(site):
-    """Retrieves and combines status of all status types (weather, enclosure, device) for a given site."""
-    all_status_entries = status_table.scan(
-        FilterExpression = Attr('site').eq(site)
-    )
-    combined_status = {}
     status_age_timestamps = {}
     latest_timestamp = 0
-    for item in all_status_entries['Items']:
-        combined_status = dict(combined_status, **item.get('status', {})) 
+    for item in all_status_entries:
         status_age_timestamps[item.get('statusType')] = item.get('server_timestamp_ms')
         latest_timestamp = max(float(item.get("server_timestamp_ms", 0)), latest_timestamp)
-    return {
+    combined_status, status_sources = combine_status_entries(all_status_entries)
+    result = {
         "site": site,
         "statusType": "combined",
         "latest_status_timestamp_ms": latest_timestamp,
         "status_age_timestamps_ms": status_age_timestamps,
+        "status_sources": status_sources,
         "status": combined_status
     }
 
+    # Evict the oldest entry rather than letting the cache grow without bound. The lock is needed since
+    # handlers can run in several threads (eg. in local_server.py).
+    with combined_status_cache_lock:
+        if cache_key not in combined_status_cache and len(combined_status_cache) >= COMBINED_STATUS_CACHE_SIZE:
+            combined_status_cache.pop(next(iter(combined_status_cache)), None)
+        combined_status_cache[cache_key] = (fingerprint, result)
+
+    # Return a copy so callers can replace top level keys without changing the cached result
+    return dict(result)
+
 
 #=========================================#
 #=======       API Endpoints      ========#
@@ -229,21 +406,67 @@ def post_status_http(event, context):
     return _get_response(200, response)
 
 
+def _get_field_selection(event):
+    """Read the optional `fields` and `flat` query parameters used to trim status responses.
+
+    Returns:
+        tuple: (field_paths, flat) where field_paths is a list of paths as returned by parse_status_fields
+        (empty if all fields were requested), and flat is True if the timestamp wrappers should be removed.
+
+    Raises:
+        ValueError: if the `fields` parameter is invalid
+    """
+    query_params = event.get('queryStringParameters') or {}
+    field_paths = parse_status_fields(query_params.get('fields', ''))
+    flat = str(query_params.get('flat', '')).lower() == 'true'
+    return field_paths, flat
+
+
+def _apply_field_selection(status, field_paths, flat):
+    """Trim the status tree of a status entry down to the requested fields."""
+    if 'status' not in status:
+        return status
+    if field_paths:
+        status['status'] = filter_status_fields(status['status'], field_paths)
+    if flat:
+        status['status'] = flatten_status(status['status'])
+    # Only list the sources of device types that are still in the status
+    if 'status_sources' in status:
+        status['status_sources'] = {device_type: sources for device_type, sources in status['status_sources'].items()
+                                    if device_type in status['status']}
+    return status
+
+
 def get_site_status(event, context):
-    """Return the status for the requested site and status type."""
+    """Return the status for the requested site and status type.
+
+    Accepts the optional query parameters `fields` (eg. "enclosure.*.shutter_status,mount.mount1.ra")
+    to return only some parts of the status, and `flat=true` to return values without their timestamps.
+    """
     site = event['pathParameters']['site']
     status_type = event['pathParameters']['status_type']
-    status = get_status(site, status_type)
-    return _get_response(200, status)
+    try:
+        field_paths, flat = _get_field_selection(event)
+    except ValueError as e:
+        return _get_response(400, str(e))
+    status = get_status(site, status_type, field_paths)
+    return _get_response(200, _apply_field_selection(status, field_paths, flat))
 
 
 def get_site_complete_status(event, context):
-    """Return the full status for the requested site."""
+    """Return the full status for the requested site.
+
+    Accepts the same optional `fields` and `flat` query parameters as get_site_status.
+    """
     if event['pathParameters']['site'] == '':
         return _get_response(400, 'Site not provided.')
     site = event['pathParameters']['site']
-    status = get_combined_site_status(site)
-    return _get_response(200, status)
+    try:
+        field_paths, flat = _get_field_selection(event)
+    except ValueError as e:
+        return _get_response(400, str(e))
+    status = get_combined_site_status(site, field_paths)
+    return _get_response(200, _apply_field_selection(status, field_paths, flat))
 
 
 def clear_all_site_status(event, context):
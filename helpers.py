@@ -1,6 +1,11 @@
-import json, boto3, decimal
+import json, boto3, decimal, threading
 
 
+# Sparse GSI used to find status entries that have stopped updating. Every status write sets
+# the partition attribute; the stale status sweeper removes it once an entry is marked stale.
+FRESHNESS_INDEX_NAME = "freshness-index"
+FRESHNESS_PARTITION = "active"
+
 #=========================================#
 #=======    Utility Functions     ========#
 #=========================================#
@@ -44,15 +49,29 @@ def _empty_strings_to_dash(d):
         if type(d[x]) is dict: d[x] = _empty_strings_to_dash(d[x])
     return d
 
+# boto3 clients are thread safe but creating them isn't, so the sqs client and queue url used by
+# send_to_datastream are created once and shared (including between warm lambda invocations).
+_sqs_lock = threading.Lock()
+_sqs_client = None
+_queue_urls = {}
+
+def _get_sqs_client():
+    global _sqs_client
+    with _sqs_lock:
+        if _sqs_client is None:
+            _sqs_client = boto3.client("sqs", region_name="us-east-1")
+        return _sqs_client
+
 def get_queue_url(queueName):
-    sqs_client = boto3.client("sqs", region_name="us-east-1")
-    response = sqs_client.get_queue_url(
-        QueueName=queueName,
-    )
-    return response["QueueUrl"]
+    if queueName not in _queue_urls:
+        response = _get_sqs_client().get_queue_url(
+            QueueName=queueName,
+        )
+        _queue_urls[queueName] = response["QueueUrl"]
+    return _queue_urls[queueName]
 
 def send_to_datastream(site, data, topic="sitestatus"):
-    sqs = boto3.client('sqs')
+    sqs = _get_sqs_client()
     queue_url = get_queue_url('datastreamIncomingQueue-dev')
 
     payload = {
@@ -122,3 +141,173 @@ def merge_dicts(main_dict, updates_dict):
         else:
             main_dict[k] = updates_dict[k]
     return main_dict
+
+
+# Limits on the `fields` query parameter, chosen to keep the compiled ProjectionExpression well within
+# DynamoDB's expression limits (4 KB expression, 32 levels of nesting, 255 byte attribute names).
+MAX_STATUS_FIELDS = 50
+MAX_STATUS_FIELD_DEPTH = 8
+MAX_STATUS_FIELD_KEY_LENGTH = 255
+
+def parse_status_fields(fields):
+    """Parse a comma separated list of status field paths, eg. from the `fields` query parameter.
+
+    Args:
+        fields (str): paths into the status tree, eg. "enclosure.*.shutter_status,mount.mount1.ra".
+            A `*` matches any key at that level.
+
+    Returns:
+        list: each path as a list of keys, eg. [["enclosure", "*", "shutter_status"], ["mount", "mount1", "ra"]]
+
+    Raises:
+        ValueError: if a path has an empty key (eg. "mount..ra" or "mount."), or if there are too many,
+        too deep, or too long paths to compile into a DynamoDB projection expression.
+    """
+    field_paths = []
+    for field in (fields or "").split(","):
+        if not field.strip():
+            continue
+        keys = [key.strip() for key in field.strip().split(".")]
+        if not all(keys):
+            raise ValueError(f"Invalid field '{field.strip()}': field paths can't contain empty keys.")
+        if len(keys) > MAX_STATUS_FIELD_DEPTH:
+            raise ValueError(f"Invalid field '{field.strip()}': field paths can have at most {MAX_STATUS_FIELD_DEPTH} keys.")
+        if any(len(key.encode("utf-8")) > MAX_STATUS_FIELD_KEY_LENGTH for key in keys):
+            raise ValueError(f"Invalid field '{field.strip()}': keys can be at most {MAX_STATUS_FIELD_KEY_LENGTH} bytes long.")
+        field_paths.append(keys)
+    if len(field_paths) > MAX_STATUS_FIELDS:
+        raise ValueError(f"Too many fields requested: at most {MAX_STATUS_FIELDS} are allowed.")
+    return field_paths
+
+
+def build_projection_expression(field_paths, attributes=("site", "statusType", "server_timestamp_ms")):
+    """Compile status field paths into a DynamoDB ProjectionExpression.
+
+    Paths are projected up to their first wildcard; the rest of the path has to be filtered after reading
+    (see filter_status_fields). Paths nested under another projected path are dropped, since DynamoDB
+    rejects overlapping document paths.
+
+    Args:
+        field_paths (list): paths into the status tree, as returned by parse_status_fields
+        attributes (tuple): top level item attributes to include in the projection as well
+
+    Returns:
+        tuple: (projection_expression, expression_attribute_names), to be used as the ProjectionExpression
+        and ExpressionAttributeNames arguments of get_item, scan, or query.
+    """
+    document_paths = []
+    for keys in field_paths:
+        prefix = keys.index("*") if "*" in keys else len(keys)
+        document_paths.append(["status"] + keys[:prefix])
+    document_paths += [[attribute] for attribute in attributes]
+
+    # Keep the shortest paths so that no projected path is nested in another
+    projected_paths = []
+    for path in sorted(document_paths, key=len):
+        if not any(path[:len(p)] == p for p in projected_paths):
+            projected_paths.append(path)
+
+    # Use placeholders for every name, since status keys may be reserved words (like "status")
+    placeholders = {}
+    expressions = []
+    for path in projected_paths:
+        for key in path:
+            placeholders.setdefault(key, f"#f{len(placeholders)}")
+        expressions.append(".".join(placeholders[key] for key in path))
+
+    expression_attribute_names = {placeholder: key for key, placeholder in placeholders.items()}
+    return ", ".join(expressions), expression_attribute_names
+
+
+def filter_status_fields(status, field_paths):
+    """Return a copy of the status tree containing only the requested field paths.
+
+    For example, filtering with the path ["enclosure", "*", "shutter_status"] keeps the shutter_status
+    of every enclosure instance and drops everything else.
+    """
+    filtered = {}
+    for keys in field_paths:
+        _copy_status_path(status, filtered, keys)
+    return filtered
+
+
+def _copy_status_path(source, destination, keys):
+    if not isinstance(source, dict):
+        return
+    matching_keys = list(source) if keys[0] == "*" else [keys[0]] if keys[0] in source else []
+    for key in matching_keys:
+        if len(keys) == 1:
+            destination[key] = source[key]
+        elif isinstance(source[key], dict):
+            subtree = destination.setdefault(key, {})
+            _copy_status_path(source[key], subtree, keys[1:])
+            if not subtree:
+                del destination[key]
+
+
+def flatten_status(status):
+    """Replace the {"val": ..., "timestamp": ...} wrappers added by add_item_timestamps with just the values."""
+    if not isinstance(status, dict):
+        return status
+    if set(status) == {"val", "timestamp"}:
+        return status["val"]
+    return {key: flatten_status(value) for key, value in status.items()}
+
+
+def combine_status_entries(status_entries):
+    """Combine the status trees of several status entries (eg. weather, enclosure, device) of one site.
+
+    Device types that appear in only one entry are used as is. When several entries report the same
+    device type, their subtrees are merged and each status value is taken from whichever entry has the
+    newest per-key timestamp (added by add_item_timestamps). Values without a timestamp fall back to the
+    server_timestamp_ms of their entry. Ties go to the entry with the greater statusType, so the result
+    doesn't depend on the order of the entries.
+
+    Args:
+        status_entries (list): status table items, each with "statusType", "server_timestamp_ms" and "status"
+
+    Returns:
+        tuple: (combined_status, status_sources) where status_sources maps each device type to the list of
+        statusTypes that contributed to it, eg. {"mount": ["device"], "observing_conditions": ["weather"]}
+    """
+    # Collect the subtrees reported for each device type, in statusType order so that ties are resolved
+    # the same way regardless of the order of the entries
+    device_subtrees = {}
+    status_sources = {}
+    for entry in sorted(status_entries, key=lambda entry: entry.get("statusType") or ""):
+        entry_timestamp = entry.get("server_timestamp_ms", 0)
+        for device_type, subtree in entry.get("status", {}).items():
+            device_subtrees.setdefault(device_type, []).append((subtree, entry_timestamp))
+            status_sources.setdefault(device_type, []).append(entry.get("statusType"))
+
+    combined_status = {device_type: _merge_newest(subtrees) for device_type, subtrees in device_subtrees.items()}
+    return combined_status, status_sources
+
+
+def _is_timestamped_value(value):
+    return isinstance(value, dict) and set(value) == {"val", "timestamp"}
+
+
+def _merge_newest(subtrees):
+    """Merge status subtrees without modifying them, keeping the newest version of every value.
+
+    Args:
+        subtrees (list): (subtree, entry_timestamp) pairs, where entry_timestamp is the server_timestamp_ms of
+            the entry the subtree came from. It is used for values that don't have their own timestamp.
+            Later subtrees win ties.
+    """
+    if len(subtrees) == 1:
+        return subtrees[0][0]
+
+    values = [value for value, _ in subtrees]
+    if all(isinstance(value, dict) and not _is_timestamped_value(value) for value in values):
+        merged = {}
+        for key in dict.fromkeys(key for value in values for key in value):
+            merged[key] = _merge_newest([(value[key], ts) for value, ts in subtrees if key in value])
+        return merged
+
+    def value_timestamp(indexed_subtree):
+        index, (value, entry_timestamp) = indexed_subtree
+        return (value["timestamp"] if _is_timestamped_value(value) else entry_timestamp, index)
+
+    return max(enumerate(subtrees), key=value_timestamp)[1][0]
@@ -0,0 +1,439 @@
+import argparse, asyncio, decimal, importlib, json, os, sys, time, traceback, uuid
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+"""
+Lightweight asyncio http server for local development and load testing.
+
+The routes and table definitions are read from serverless.yml, and every request is handed to the same
+lambda handler function that would serve it in AWS, run in a thread pool so many requests can be in flight
+at once. Unlike serverless-offline, no node or java processes are needed.
+
+Example usage:
+    $ python local_server.py --backend memory --seed
+    $ curl http://localhost:3000/dev/allopenstatus
+
+Backends:
+    memory:   pure python tables from memory_table.py (default, no other services required)
+    moto:     tables created in moto's mocked dynamodb (requires `pip install moto`)
+    dynamodb: an existing dynamodb endpoint, eg. the serverless local dynamodb on port 9000 or AWS itself
+
+Note that dynamodb streams are not emulated, so the stream handler is not triggered by status updates.
+"""
+
+SERVERLESS_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "serverless.yml")
+SAMPLE_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sample_data")
+
+# Module level table variables used by the handlers, grouped by the serverless.yml resource they refer to
+TABLE_BINDINGS = {
+    "statusTable": [("handler", "status_table"), ("stale_status", "status_table")],
+    "phaseStatusTable": [("phase_status", "phase_status_table")],
+    "streamCheckpointTable": [("handler", "stream_checkpoint_table")],
+}
+
+# Seed data files, as used by the serverless local dynamodb
+SEED_FILES = {
+    "statusTable": "statusTable.json",
+    "phaseStatusTable": "phaseStatusTable.json",
+}
+
+# Modules that send messages to datastream
+DATASTREAM_MODULES = ["handler", "phase_status", "stale_status"]
+
+CORS_HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Credentials": "true",
+    "Access-Control-Allow-Headers": "*",
+    "Access-Control-Allow-Methods": "GET,POST,OPTIONS",
+}
+
+
+#=========================================#
+#=======   serverless.yml Parsing   ======#
+#=========================================#
+
+def load_serverless_config(path=SERVERLESS_CONFIG):
+    try:
+        import yaml
+    except ImportError:
+        sys.exit("The local server requires PyYAML to be installed: pip install pyyaml")
+    with open(path) as f:
+        return yaml.safe_load(f)
+
+
+class Route:
+    """An http route from serverless.yml, eg. GET /{site}/{status_type} -> handler.get_site_status"""
+
+    def __init__(self, method, path, handler):
+        self.method = method.upper()
+        self.path = '/' + path.strip('/')
+        self.handler = handler
+        self.segments = [s for s in self.path.split('/') if s]
+        self._handler_function = None
+
+    @property
+    def specificity(self):
+        """Sort key so that static path segments take priority over path parameters, like API Gateway."""
+        return tuple(1 if s.startswith('{') else 0 for s in self.segments)
+
+    def match(self, path_segments):
+        """Return the path parameters if the path matches this route, otherwise None."""
+        if len(path_segments) != len(self.segments):
+            return None
+        path_parameters = {}
+        for route_segment, segment in zip(self.segments, path_segments):
+            if route_segment.startswith('{'):
+                path_parameters[route_segment.strip('{}')] = segment
+            elif route_segment != segment:
+                return None
+        return path_parameters
+
+    def handler_function(self):
+        if self._handler_function is None:
+            module_name, function_name = self.handler.rsplit('.', 1)
+            self._handler_function = getattr(importlib.import_module(module_name), function_name)
+        return self._handler_function
+
+
+def get_routes(config):
+    """Create a Route for every http event in the serverless.yml functions."""
+    routes = []
+    for function in config.get('functions', {}).values():
+        for event in function.get('events', []):
+            if 'http' in event:
+                routes.append(Route(event['http']['method'], event['http']['path'], function['handler']))
+    return sorted(routes, key=lambda r: r.specificity)
+
+
+def get_table_schemas(config):
+    """Return the key schema of every dynamodb table resource in serverless.yml.
+
+    Returns:
+        dict: {resource_name: {"hash_key": str, "range_key": str or None, "indexes": {name: (hash, range)},
+               "properties": dict}}
+    """
+    schemas = {}
+    for resource_name, resource in config['resources']['Resources'].items():
+        if resource.get('Type') != 'AWS::DynamoDB::Table':
+            continue
+        properties = resource['Properties']
+        hash_key, range_key = _parse_key_schema(properties['KeySchema'])
+        indexes = {index['IndexName']: _parse_key_schema(index['KeySchema'])
+                   for index in properties.get('GlobalSecondaryIndexes', [])}
+        schemas[resource_name] = {
+            "hash_key": hash_key,
+            "range_key": range_key,
+            "indexes": indexes,
+            "properties": properties,
+        }
+    return schemas
+
+
+def _parse_key_schema(key_schema):
+    keys = {k['KeyType']: k['AttributeName'] for k in key_schema}
+    return keys['HASH'], keys.get('RANGE')
+
+
+#=========================================#
+#=======         Backends         ========#
+#=========================================#
+
+def create_memory_tables(schemas, stage):
+    from memory_table import MemoryTable
+    return {
+        resource_name: MemoryTable(
+            _table_name(resource_name, stage),
+            schema['hash_key'],
+            schema['range_key'],
+            schema['indexes'],
+        )
+        for resource_name, schema in schemas.items()
+    }
+
+
+def create_moto_tables(schemas, stage):
+    try:
+        import moto
+    except ImportError:
+        sys.exit("The moto backend requires moto to be installed: pip install moto")
+    import boto3
+
+    # moto refuses to start without credentials, but never uses them
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+
+    # moto 5 replaced the service specific decorators with mock_aws
+    mock = moto.mock_aws() if hasattr(moto, 'mock_aws') else moto.mock_dynamodb()
+    mock.start()
+
+    dynamodb = boto3.resource('dynamodb')
+    tables = {}
+    for resource_name, schema in schemas.items():
+        properties = schema['properties']
+        table_args = {
+            "TableName": _table_name(resource_name, stage),
+            "AttributeDefinitions": properties['AttributeDefinitions'],
+            "KeySchema": properties['KeySchema'],
+            "BillingMode": "PAY_PER_REQUEST",
+        }
+        if 'GlobalSecondaryIndexes' in properties:
+            table_args['GlobalSecondaryIndexes'] = properties['GlobalSecondaryIndexes']
+        tables[resource_name] = dynamodb.create_table(**table_args)
+    return tables
+
+
+def create_dynamodb_tables(schemas, stage, endpoint_url):
+    import boto3
+    dynamodb = boto3.resource('dynamodb', endpoint_url=endpoint_url)
+    return {resource_name: dynamodb.Table(_table_name(resource_name, stage)) for resource_name in schemas}
+
+
+def _table_name(resource_name, stage):
+    names = {
+        "statusTable": f"photonranch-status-{stage}",
+        "phaseStatusTable": f"phase-status-{stage}",
+        "streamCheckpointTable": f"photonranch-status-stream-checkpoints-{stage}",
+    }
+    return names.get(resource_name, f"{resource_name}-{stage}")
+
+
+def seed_tables(tables):
+    """Load the sample data files (see sample_data/copy_dynamodb_data.py) into the tables."""
+    for resource_name, filename in SEED_FILES.items():
+        path = os.path.join(SAMPLE_DATA_DIR, filename)
+        if resource_name not in tables or not os.path.isfile(path) or os.path.getsize(path) == 0:
+            continue
+        with open(path) as f:
+            items = json.load(f, parse_float=decimal.Decimal)
+        for item in items:
+            tables[resource_name].put_item(Item=item)
+        print(f"Seeded {len(items)} items into {resource_name} from {path}")
+
+
+def bind_tables(tables):
+    """Point the module level table variables used by the handlers at the backend tables."""
+    for resource_name, bindings in TABLE_BINDINGS.items():
+        for module_name, attribute in bindings:
+            setattr(importlib.import_module(module_name), attribute, tables[resource_name])
+
+
+def bind_datastream_logger():
+    """Replace send_to_datastream in the handler modules with a function that only logs the message."""
+    def log_datastream_message(site, data, topic="sitestatus"):
+        print(f"datastream message: topic={topic} site={site} size={len(json.dumps(data, default=str))}")
+
+    for module_name in DATASTREAM_MODULES:
+        setattr(importlib.import_module(module_name), 'send_to_datastream', log_datastream_message)
+
+
+#=========================================#
+#=======        HTTP Server       ========#
+#=========================================#
+
+def _reason_phrase(status_code):
+    try:
+        return HTTPStatus(status_code).phrase
+    except ValueError:
+        return ''
+
+
+class LambdaContext:
+    """Minimal stand-in for the lambda context object passed to handlers."""
+
+    def __init__(self, function_name):
+        self.function_name = function_name
+        self.aws_request_id = str(uuid.uuid4())
+        self.memory_limit_in_mb = 1024
+
+
+class LocalServer:
+
+    def __init__(self, routes, base_path, max_workers):
+        self.routes = routes
+        self.base_path = '/' + base_path.strip('/') if base_path.strip('/') else ''
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def find_route(self, method, path):
+        if self.base_path and (path == self.base_path or path.startswith(self.base_path + '/')):
+            path = path[len(self.base_path):]
+        path_segments = [unquote(s) for s in path.split('/') if s]
+        for route in self.routes:
+            if route.method != method:
+                continue
+            path_parameters = route.match(path_segments)
+            if path_parameters is not None:
+                return route, path_parameters
+        return None, None
+
+    def build_event(self, method, route, path, path_parameters, query, headers, body):
+        """Build an API Gateway (lambda proxy integration) event for the request."""
+        query_parameters = dict(parse_qsl(query, keep_blank_values=True))
+        return {
+            "resource": route.path,
+            "path": path,
+            "httpMethod": method,
+            "headers": headers,
+            "pathParameters": path_parameters or None,
+            "queryStringParameters": query_parameters or None,
+            "body": body.decode('utf-8') if body else None,
+            "isBase64Encoded": False,
+            "requestContext": {
+                "httpMethod": method,
+                "path": path,
+                "requestTimeEpoch": int(time.time() * 1000),
+            },
+        }
+
+    async def handle_request(self, method, target, headers, body):
+        """Run the matching handler and return a (status_code, headers, body) tuple."""
+        url = urlsplit(target)
+
+        if method == 'OPTIONS':
+            return 204, dict(CORS_HEADERS), b''
+
+        route, path_parameters = self.find_route(method, url.path)
+        if route is None:
+            return 404, dict(CORS_HEADERS), json.dumps({"message": "Not Found"}).encode()
+
+        event = self.build_event(method, route, url.path, path_parameters, url.query, headers, body)
+        context = LambdaContext(route.handler)
+        loop = asyncio.get_running_loop()
+        try:
+            response = await loop.run_in_executor(self.executor, route.handler_function(), event, context)
+        except Exception:
+            traceback.print_exc()
+            return 502, dict(CORS_HEADERS), json.dumps({"message": "Internal server error"}).encode()
+
+        response_body = response.get('body', '')
+        if not isinstance(response_body, (str, bytes)):
+            response_body = json.dumps(response_body)
+        if isinstance(response_body, str):
+            response_body = response_body.encode('utf-8')
+        return response.get('statusCode', 200), response.get('headers') or {}, response_body
+
+    async def read_body(self, reader, writer, lower_headers, version):
+        """Read the request body, which is either sent with a Content-Length or with chunked encoding."""
+        # Clients like curl wait for this before sending larger bodies
+        if lower_headers.get('expect', '').lower() == '100-continue' and version == 'HTTP/1.1':
+            writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+            await writer.drain()
+
+        if 'chunked' in lower_headers.get('transfer-encoding', '').lower():
+            chunks = []
+            while True:
+                size_line = await reader.readline()
+                chunk_size = int(size_line.split(b';')[0].strip(), 16)
+                if chunk_size == 0:
+                    # Skip any trailer headers up to the blank line that ends the body
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    return b''.join(chunks)
+                chunks.append(await reader.readexactly(chunk_size))
+                await reader.readline()
+
+        content_length = int(lower_headers.get('content-length', 0))
+        return await reader.readexactly(content_length) if content_length else b''
+
+    async def handle_connection(self, reader, writer):
+        """Serve http/1.1 requests on a connection until the client closes it."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode('latin-1').split()
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip()] = value.strip()
+
+                lower_headers = {k.lower(): v for k, v in headers.items()}
+                body = await self.read_body(reader, writer, lower_headers, version)
+
+                start = time.perf_counter()
+                status_code, response_headers, response_body = await self.handle_request(
+                    method.upper(), target, headers, body)
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                print(f"{method} {target} {status_code} {elapsed_ms:.1f}ms")
+
+                keep_alive = lower_headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+                head = [f"HTTP/1.1 {status_code} {_reason_phrase(status_code)}"]
+                response_headers = dict(response_headers)
+                response_headers.setdefault('Content-Type', 'application/json')
+                response_headers['Content-Length'] = str(len(response_body))
+                response_headers['Connection'] = 'keep-alive' if keep_alive else 'close'
+                head += [f"{k}: {v}" for k, v in response_headers.items()]
+                writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + response_body)
+                await writer.drain()
+
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionResetError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        print(f"Serving on http://{host}:{port}{self.base_path}/")
+        for route in self.routes:
+            print(f"  {route.method:<6} {self.base_path}{route.path} -> {route.handler}")
+        async with server:
+            await server.serve_forever()
+
+
+def main():
+    description = """Runs the lambda http handlers behind a local asyncio http server,
+        with routes taken from serverless.yml"""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--host", type=str, default="localhost", help="Host to listen on (default: localhost)")
+    parser.add_argument("--port", type=int, default=3000, help="Port to listen on (default: 3000)")
+    parser.add_argument("--stage", type=str, default="dev", help="Stage used for table names and the base path (default: dev)")
+    parser.add_argument("--base-path", type=str, default=None, help="Path prefix for all routes (default: /<stage>)")
+    parser.add_argument("--backend", choices=["memory", "moto", "dynamodb"], default="memory", help="Table backend (default: memory)")
+    parser.add_argument("--endpoint-url", type=str, default="http://localhost:9000", help="Dynamodb endpoint for the dynamodb backend, or 'aws' for the real service (default: http://localhost:9000)")
+    parser.add_argument("--seed", action="store_true", help="Load the sample_data json files into the memory or moto tables")
+    parser.add_argument("--workers", type=int, default=32, help="Size of the thread pool running the handlers (default: 32)")
+    parser.add_argument("--datastream", choices=["log", "sqs"], default="log", help="Log datastream messages instead of sending them to sqs (default: log)")
+    args = parser.parse_args()
+
+    # The handler modules create boto3 resources at import time, which requires a region
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    os.environ.pop("IS_OFFLINE", None)
+
+    config = load_serverless_config()
+    schemas = get_table_schemas(config)
+
+    if args.backend == "memory":
+        tables = create_memory_tables(schemas, args.stage)
+    elif args.backend == "moto":
+        tables = create_moto_tables(schemas, args.stage)
+    else:
+        endpoint_url = None if args.endpoint_url == "aws" else args.endpoint_url
+        tables = create_dynamodb_tables(schemas, args.stage, endpoint_url)
+
+    if args.seed:
+        if args.backend == "dynamodb":
+            print("Warning: --seed is ignored for the dynamodb backend")
+        else:
+            seed_tables(tables)
+
+    bind_tables(tables)
+    if args.datastream == "log":
+        bind_datastream_logger()
+
+    base_path = args.base_path if args.base_path is not None else args.stage
+    server = LocalServer(get_routes(config), base_path, args.workers)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
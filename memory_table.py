@@ -0,0 +1,278 @@
+import re, threading
+from boto3.dynamodb.types import TypeSerializer, TypeDeserializer
+from botocore.exceptions import ClientError
+
+"""
+A pure python, in-memory stand-in for a boto3 DynamoDB Table resource.
+
+Used by local_server.py so the handlers can be exercised without a DynamoDB endpoint. Only the parts of
+the Table API used by this project are implemented: get_item, put_item, delete_item, update_item (simple
+SET/REMOVE expressions), scan, and query (including sparse global secondary indexes). Projection expressions
+are supported for get_item, scan and query, and condition expressions for put_item and update_item.
+
+Items are stored in their DynamoDB wire format, so writes are validated the same way boto3 validates them
+(e.g. floats are rejected) and reads return Decimals just like the real service.
+"""
+
+_serializer = TypeSerializer()
+_deserializer = TypeDeserializer()
+
+_MISSING = object()
+
+_COMPARISONS = {
+    '=': lambda a, b: a == b,
+    '<>': lambda a, b: a != b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+}
+
+
+def _client_error(code, message, operation_name):
+    return ClientError({"Error": {"Code": code, "Message": message}}, operation_name)
+
+
+def _get_path(item, path):
+    """Return the value at a dotted attribute path, or _MISSING if any part of it doesn't exist."""
+    value = item
+    for part in path.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+
+def _evaluate_condition(condition, item):
+    """Evaluate a boto3 condition object (eg. Attr('site').eq('tst')) against an item."""
+    expression = condition.get_expression()
+    operator = expression['operator']
+    values = expression['values']
+
+    if operator == 'AND':
+        return all(_evaluate_condition(v, item) for v in values)
+    if operator == 'OR':
+        return any(_evaluate_condition(v, item) for v in values)
+    if operator == 'NOT':
+        return not _evaluate_condition(values[0], item)
+
+    actual = _get_path(item, values[0].name)
+    if operator == 'attribute_exists':
+        return actual is not _MISSING
+    if operator == 'attribute_not_exists':
+        return actual is _MISSING
+    if actual is _MISSING:
+        return False
+
+    try:
+        if operator in _COMPARISONS:
+            return _COMPARISONS[operator](actual, values[1])
+        if operator == 'BETWEEN':
+            return values[1] <= actual <= values[2]
+        if operator == 'begins_with':
+            return actual.startswith(values[1])
+        if operator == 'IN':
+            return actual in values[1]
+        if operator == 'contains':
+            return values[1] in actual
+    except TypeError:
+        # Comparisons between mismatched types never match in DynamoDB
+        return False
+    raise NotImplementedError(f"Condition operator '{operator}' is not supported by MemoryTable")
+
+
+def _resolve_name(name, attribute_names):
+    """Substitute #placeholders in an attribute path with their ExpressionAttributeNames values."""
+    return '.'.join(attribute_names.get(part, part) for part in name.split('.'))
+
+
+def _evaluate_condition_string(expression, item, attribute_names, attribute_values):
+    """Evaluate a simple string condition expression made of comparisons joined by AND."""
+    for clause in re.split(r'\s+AND\s+', expression.strip(), flags=re.IGNORECASE):
+        function_match = re.fullmatch(r'(attribute_exists|attribute_not_exists)\s*\(\s*([#\w.]+)\s*\)', clause.strip())
+        if function_match:
+            function, name = function_match.groups()
+            exists = _get_path(item, _resolve_name(name, attribute_names)) is not _MISSING
+            if exists != (function == 'attribute_exists'):
+                return False
+            continue
+
+        comparison_match = re.fullmatch(r'([#\w.]+)\s*(=|<>|<=|>=|<|>)\s*(:\w+)', clause.strip())
+        if not comparison_match:
+            raise NotImplementedError(f"Condition expression '{expression}' is not supported by MemoryTable")
+        name, operator, placeholder = comparison_match.groups()
+        actual = _get_path(item, _resolve_name(name, attribute_names))
+        if actual is _MISSING:
+            return False
+        try:
+            if not _COMPARISONS[operator](actual, attribute_values[placeholder]):
+                return False
+        except TypeError:
+            return False
+    return True
+
+
+def _apply_projection(item, projection_expression, attribute_names):
+    """Return a copy of the item with only the attribute paths listed in the projection expression."""
+    if projection_expression is None:
+        return item
+    projected = {}
+    for name in projection_expression.split(','):
+        keys = _resolve_name(name.strip(), attribute_names or {}).split('.')
+        source, destination = item, projected
+        for key in keys[:-1]:
+            if not isinstance(source.get(key), dict):
+                break
+            source = source[key]
+            destination = destination.setdefault(key, {})
+        else:
+            if keys[-1] in source:
+                destination[keys[-1]] = source[keys[-1]]
+    return projected
+
+
+class MemoryTable:
+    """In-memory DynamoDB table with the same call signatures as a boto3 Table resource.
+
+    Args:
+        name (str): table name, only used for logging
+        hash_key (str): name of the partition key attribute
+        range_key (str): name of the sort key attribute, or None
+        indexes (dict): global secondary indexes as {index_name: (hash_key, range_key)}. Indexes are
+            treated as KEYS_ONLY projections.
+    """
+
+    def __init__(self, name, hash_key, range_key=None, indexes=None):
+        self.name = name
+        self.hash_key = hash_key
+        self.range_key = range_key
+        self.indexes = indexes or {}
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def _key_tuple(self, key):
+        try:
+            if self.range_key is None:
+                return (key[self.hash_key],)
+            return (key[self.hash_key], key[self.range_key])
+        except KeyError:
+            raise _client_error("ValidationException",
+                                "The provided key element does not match the schema", "GetItem")
+
+    def _table_keys(self):
+        return [k for k in (self.hash_key, self.range_key) if k is not None]
+
+    def _check_condition(self, condition_expression, item, attribute_names, attribute_values, operation_name):
+        if isinstance(condition_expression, str):
+            passed = _evaluate_condition_string(condition_expression, item, attribute_names, attribute_values)
+        else:
+            passed = _evaluate_condition(condition_expression, item)
+        if not passed:
+            raise _client_error("ConditionalCheckFailedException", "The conditional request failed", operation_name)
+
+    def _read(self, stored):
+        return {k: _deserializer.deserialize(v) for k, v in stored.items()}
+
+    def _write(self, item):
+        self._items[self._key_tuple(item)] = {k: _serializer.serialize(v) for k, v in item.items()}
+
+    def get_item(self, Key, ProjectionExpression=None, ExpressionAttributeNames=None, **kwargs):
+        with self._lock:
+            stored = self._items.get(self._key_tuple(Key))
+            if stored is None:
+                return {}
+            item = self._read(stored)
+        return {"Item": _apply_projection(item, ProjectionExpression, ExpressionAttributeNames)}
+
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeNames=None,
+                 ExpressionAttributeValues=None, **kwargs):
+        with self._lock:
+            if ConditionExpression is not None:
+                stored = self._items.get(self._key_tuple(Item))
+                self._check_condition(ConditionExpression, self._read(stored) if stored is not None else {},
+                                      ExpressionAttributeNames or {}, ExpressionAttributeValues or {}, "PutItem")
+            self._write(Item)
+        return {}
+
+    def delete_item(self, Key, **kwargs):
+        with self._lock:
+            self._items.pop(self._key_tuple(Key), None)
+        return {}
+
+    def update_item(self, Key, UpdateExpression, ConditionExpression=None,
+                    ExpressionAttributeNames=None, ExpressionAttributeValues=None, **kwargs):
+        names = ExpressionAttributeNames or {}
+        values = ExpressionAttributeValues or {}
+        with self._lock:
+            stored = self._items.get(self._key_tuple(Key))
+            item = self._read(stored) if stored is not None else dict(Key)
+
+            if ConditionExpression is not None:
+                self._check_condition(ConditionExpression, item, names, values, "UpdateItem")
+
+            # Split the expression into its SET and REMOVE clauses
+            for action, clause in re.findall(r'(SET|REMOVE)\s+(.*?)(?=\s+(?:SET|REMOVE)\s+|$)',
+                                             UpdateExpression.strip(), flags=re.IGNORECASE):
+                for part in clause.split(','):
+                    if action.upper() == 'SET':
+                        name, placeholder = [p.strip() for p in part.split('=')]
+                        item[_resolve_name(name, names)] = values[placeholder]
+                    else:
+                        item.pop(_resolve_name(part.strip(), names), None)
+
+            self._write(item)
+        return {}
+
+    def scan(self, FilterExpression=None, ProjectionExpression=None, ExpressionAttributeNames=None, **kwargs):
+        with self._lock:
+            items = [self._read(stored) for stored in self._items.values()]
+        scanned_count = len(items)
+        if FilterExpression is not None:
+            items = [item for item in items if _evaluate_condition(FilterExpression, item)]
+        items = [_apply_projection(item, ProjectionExpression, ExpressionAttributeNames) for item in items]
+        return {"Items": items, "Count": len(items), "ScannedCount": scanned_count}
+
+    def query(self, KeyConditionExpression, IndexName=None, ScanIndexForward=True, Limit=None,
+              ExclusiveStartKey=None, ProjectionExpression=None, ExpressionAttributeNames=None, **kwargs):
+        if IndexName is None:
+            hash_key, range_key = self.hash_key, self.range_key
+        elif IndexName in self.indexes:
+            hash_key, range_key = self.indexes[IndexName]
+        else:
+            raise _client_error("ValidationException",
+                                f"The table does not have the specified index: {IndexName}", "Query")
+
+        with self._lock:
+            items = [self._read(stored) for stored in self._items.values()]
+
+        # Global secondary indexes are sparse: items without the index keys don't appear in them
+        index_keys = [k for k in (hash_key, range_key) if k is not None]
+        items = [item for item in items if all(k in item for k in index_keys)]
+        items = [item for item in items if _evaluate_condition(KeyConditionExpression, item)]
+        scanned_count = len(items)
+
+        # Break ties on the table keys so that pages are stable between calls
+        items.sort(key=lambda item: (item[range_key] if range_key is not None else 0,
+                                     tuple(str(item[k]) for k in self._table_keys())),
+                   reverse=not ScanIndexForward)
+
+        if ExclusiveStartKey is not None:
+            start_key = self._key_tuple(ExclusiveStartKey)
+            positions = [i for i, item in enumerate(items) if self._key_tuple(item) == start_key]
+            if positions:
+                items = items[positions[0] + 1:]
+
+        last_evaluated_key = None
+        if Limit is not None and len(items) > Limit:
+            items = items[:Limit]
+            last_evaluated_key = {k: items[-1][k] for k in set(self._table_keys() + index_keys)}
+
+        if IndexName is not None:
+            projected_keys = set(self._table_keys() + index_keys)
+            items = [{k: v for k, v in item.items() if k in projected_keys} for item in items]
+        items = [_apply_projection(item, ProjectionExpression, ExpressionAttributeNames) for item in items]
+
+        response = {"Items": items, "Count": len(items), "ScannedCount": scanned_count}
+        if last_evaluated_key is not None:
+            response["LastEvaluatedKey"] = last_evaluated_key
+        return response
@@ -52,7 +52,7 @@ def get_phase_status(event, context):
     except Exception as e:
         return _get_response(400, 'Missing path parameter site')
 
-    max_age_seconds = event.get('queryStringParameters', {}).get('max_age_seconds', 3600)  # default max age is 1 hour
+    max_age_seconds = (event.get('queryStringParameters') or {}).get('max_age_seconds', 3600)  # default max age is 1 hour
 
     timestamp_cutoff = int(time.time() - int(max_age_seconds))
     phase_status = phase_status_table.query(
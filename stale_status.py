@@ -0,0 +1,108 @@
+import os, time, boto3
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+
+from helpers import _get_response
+from helpers import send_to_datastream
+from helpers import FRESHNESS_INDEX_NAME
+from helpers import FRESHNESS_PARTITION
+
+try:
+    dynamodb = boto3.resource('dynamodb')
+    status_table = dynamodb.Table(os.getenv('STATUS_TABLE'))
+except Exception as e:
+    print(e)
+
+# Use local dynamodb if running with serverless-offline
+if os.getenv('IS_OFFLINE'):
+    print("In offline development mode: " + os.getenv('IS_OFFLINE'))
+    resource = boto3.resource('dynamodb', endpoint_url='http://localhost:9000')
+    status_table = resource.Table(name='photonranch-status-dev')
+
+# Status entries that haven't been updated for this many seconds are considered stale
+DEFAULT_STALE_THRESHOLD_S = 600
+
+
+def get_stale_status_entries(threshold_s):
+    """Query the freshness index for status entries older than the threshold.
+
+    Only entries that are still in the (sparse) freshness index are returned, so entries that
+    have already been marked stale are not read again until their site posts a new status.
+
+    Args:
+        threshold_s (int): minimum age in seconds for a status entry to be considered stale
+
+    Returns:
+        list: index items with the keys site, statusType and server_timestamp_ms
+    """
+    cutoff_ms = int((time.time() - threshold_s) * 1000)
+    query_args = {
+        "IndexName": FRESHNESS_INDEX_NAME,
+        "KeyConditionExpression": Key('freshness_partition').eq(FRESHNESS_PARTITION)
+            & Key('server_timestamp_ms').lt(cutoff_ms),
+    }
+    stale_entries = []
+    while True:
+        response = status_table.query(**query_args)
+        stale_entries.extend(response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            break
+        query_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    return stale_entries
+
+
+def mark_status_stale(entry):
+    """Flag a status entry as stale and remove it from the freshness index.
+
+    The update is conditional on the entry still having the timestamp we queried, so a status
+    that was updated (or cleared) after the index query is left alone.
+
+    Returns:
+        bool: True if the entry was marked stale, False if it changed in the meantime
+    """
+    try:
+        status_table.update_item(
+            Key={"site": entry['site'], "statusType": entry['statusType']},
+            UpdateExpression="SET stale = :stale REMOVE freshness_partition",
+            ConditionExpression="server_timestamp_ms = :ts",
+            ExpressionAttributeValues={
+                ":stale": True,
+                ":ts": entry['server_timestamp_ms'],
+            },
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return False
+        raise
+    return True
+
+
+def sweep_stale_status(event, context):
+    """Marks status entries that stopped updating as stale and sends one alert to datastream.
+
+    Runs on a schedule. The amount of work is proportional to the number of newly stale entries
+    rather than the total number of status entries in the table.
+    """
+    threshold_s = int(os.getenv('STALE_STATUS_THRESHOLD_S', DEFAULT_STALE_THRESHOLD_S))
+    time_now = time.time()
+
+    newly_stale = []
+    for entry in get_stale_status_entries(threshold_s):
+        if mark_status_stale(entry):
+            newly_stale.append({
+                "site": entry['site'],
+                "statusType": entry['statusType'],
+                "status_age_s": int(time_now - (float(entry['server_timestamp_ms']) / 1000)),
+            })
+
+    print(f"Marked {len(newly_stale)} status entries as stale")
+
+    # Send a single batched alert rather than one message per stale entry
+    if newly_stale:
+        payload = {
+            "threshold_s": threshold_s,
+            "stale_status": newly_stale,
+        }
+        send_to_datastream("all", payload, topic="stale_status")
+
+    return _get_response(200, {"stale_status": newly_stale})
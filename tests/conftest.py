@@ -0,0 +1,35 @@
+import pytest
+import handler
+import stale_status
+from helpers import FRESHNESS_INDEX_NAME
+from memory_table import MemoryTable
+from stream_events import FakeDatastream
+
+
+@pytest.fixture
+def status_table(monkeypatch):
+    """An empty in-memory status table, used by the handlers and the stale status sweeper."""
+    table = MemoryTable("photonranch-status-test", "site", "statusType",
+                        {FRESHNESS_INDEX_NAME: ("freshness_partition", "server_timestamp_ms")})
+    monkeypatch.setattr(handler, "status_table", table)
+    monkeypatch.setattr(stale_status, "status_table", table)
+    monkeypatch.setattr(handler, "combined_status_cache", {})
+    return table
+
+
+@pytest.fixture
+def stream_checkpoint_table(monkeypatch):
+    """An empty in-memory stream checkpoint table, with the stream handler's cached checkpoints cleared."""
+    table = MemoryTable("photonranch-status-stream-checkpoints-test", "site", "statusType")
+    monkeypatch.setattr(handler, "stream_checkpoint_table", table)
+    monkeypatch.setattr(handler, "last_sent_status", {})
+    return table
+
+
+@pytest.fixture
+def datastream(monkeypatch):
+    """Records the messages that would be sent to datastream instead of sending them."""
+    fake_datastream = FakeDatastream()
+    monkeypatch.setattr(handler, "send_to_datastream", fake_datastream)
+    monkeypatch.setattr(stale_status, "send_to_datastream", fake_datastream)
+    return fake_datastream
@@ -0,0 +1,85 @@
+import decimal, json
+from boto3.dynamodb.types import TypeSerializer
+
+"""
+Test harness for the dynamodb stream handler: builds synthetic stream batches in the format lambda
+receives them, and a fake datastream sender that can be told to fail for specific statuses.
+"""
+
+_serializer = TypeSerializer()
+
+
+def make_stream_record(site, status_type, server_timestamp_ms, sequence_number, event_name="MODIFY", status=None,
+                       stale=False):
+    """Create a dynamodb stream record (NEW_IMAGE view type) for a status table entry."""
+    keys = {"site": {"S": site}, "statusType": {"S": status_type}}
+    dynamodb = {
+        "Keys": keys,
+        "SequenceNumber": str(sequence_number),
+        "StreamViewType": "NEW_IMAGE",
+    }
+    if event_name != "REMOVE":
+        if status is None:
+            status = {"device": {"device1": {"key": {"val": sequence_number, "timestamp": server_timestamp_ms}}}}
+        item = {
+            "site": site,
+            "statusType": status_type,
+            "server_timestamp_ms": server_timestamp_ms,
+            "status": status,
+        }
+        # Entries marked stale by the stale status sweeper are removed from the freshness index
+        if stale:
+            item["stale"] = True
+        else:
+            item["freshness_partition"] = "active"
+        # Stream images store numbers as decimals, just like the table itself
+        item = json.loads(json.dumps(item), parse_float=decimal.Decimal)
+        dynamodb["NewImage"] = {key: _serializer.serialize(value) for key, value in item.items()}
+    return {
+        "eventID": f"event-{sequence_number}",
+        "eventName": event_name,
+        "eventSource": "aws:dynamodb",
+        "dynamodb": dynamodb,
+    }
+
+
+def make_stream_batch(updates, first_sequence_number=100):
+    """Create a stream event from a list of (site, status_type, server_timestamp_ms) updates, in order.
+
+    Sequence numbers increase through the batch, like the records of a single shard.
+    """
+    return {"Records": [
+        make_stream_record(site, status_type, server_timestamp_ms, first_sequence_number + i)
+        for i, (site, status_type, server_timestamp_ms) in enumerate(updates)
+    ]}
+
+
+def failed_sequence_numbers(response):
+    return [failure["itemIdentifier"] for failure in response["batchItemFailures"]]
+
+
+class FakeDatastream:
+    """Records the messages sent to datastream, failing for site statuses listed in fail_on.
+
+    Every message is kept in `messages` as (site, data, topic); site statuses are also summarized in `sent`.
+
+    Args:
+        fail_on (dict): {(site, server_timestamp_ms): number of times sending that status should fail}
+    """
+
+    def __init__(self, fail_on=None):
+        self.fail_on = dict(fail_on or {})
+        self.sent = []
+        self.messages = []
+
+    def __call__(self, site, data, topic="sitestatus"):
+        if topic == "sitestatus":
+            key = (site, data["server_timestamp_ms"])
+            if self.fail_on.get(key, 0) > 0:
+                self.fail_on[key] -= 1
+                raise Exception(f"injected failure sending {key}")
+            self.sent.append((site, data["statusType"], data["server_timestamp_ms"]))
+        self.messages.append((site, data, topic))
+
+    def sent_for(self, site):
+        return [(status_type, timestamp) for s, status_type, timestamp in self.sent if s == site]
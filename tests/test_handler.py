@@ -0,0 +1,64 @@
+import json
+import pytest
+import handler
+
+
+@pytest.fixture
+def status_table(status_table):
+    handler.post_status("tst", "device", {"mount": {"mount1": {"ra": 1, "dec": 2}}})
+    handler.post_status("tst", "enclosure", {"enclosure": {"enclosure1": {"shutter_status": "Open"}}})
+    return status_table
+
+
+def make_event(path_parameters, query_parameters=None):
+    return {"pathParameters": path_parameters, "queryStringParameters": query_parameters}
+
+
+@pytest.mark.parametrize("fields", ["mount..ra", "mount."])
+def test_invalid_fields_return_400(status_table, fields):
+    event = make_event({"site": "tst", "status_type": "device"}, {"fields": fields})
+    assert handler.get_site_status(event, {})["statusCode"] == 400
+    event = make_event({"site": "tst"}, {"fields": fields})
+    assert handler.get_site_complete_status(event, {})["statusCode"] == 400
+
+
+def test_get_site_status_with_fields(status_table):
+    event = make_event({"site": "tst", "status_type": "device"}, {"fields": "mount.*.ra", "flat": "true"})
+    response = handler.get_site_status(event, {})
+    assert response["statusCode"] == 200
+    assert json.loads(response["body"])["status"] == {"mount": {"mount1": {"ra": 1}}}
+
+
+def test_get_site_status_hides_freshness_partition(status_table):
+    response = handler.get_site_status(make_event({"site": "tst", "status_type": "device"}), {})
+    assert "freshness_partition" not in json.loads(response["body"])
+
+
+@pytest.mark.parametrize("fields", ["*.*.shutter_status", "focuser.*"])
+def test_complete_status_sources_match_filtered_status(status_table, fields):
+    event = make_event({"site": "tst"}, {"fields": fields})
+    body = json.loads(handler.get_site_complete_status(event, {})["body"])
+    assert set(body["status_sources"]) == set(body["status"])
+
+
+def test_combined_status_cache_eviction(status_table, monkeypatch):
+    monkeypatch.setattr(handler, "COMBINED_STATUS_CACHE_SIZE", 2)
+    for site in ["tst", "sro", "mrc"]:
+        handler.get_combined_site_status(site)
+    assert list(handler.combined_status_cache) == [("sro", ()), ("mrc", ())]
+
+
+def test_combined_status_reads_every_page(status_table, monkeypatch):
+    paged_query = status_table.query
+    monkeypatch.setattr(status_table, "query", lambda **kwargs: paged_query(Limit=1, **kwargs))
+    status = handler.get_combined_site_status("tst")
+    assert set(status["status_age_timestamps_ms"]) == {"device", "enclosure"}
+    assert set(status["status"]) == {"mount", "enclosure"}
+
+
+def test_forecast_status_is_not_in_freshness_index(status_table):
+    handler.post_forecast_status("tst", "forecast", {"forecast": []})
+    item = status_table.get_item(Key={"site": "tst", "statusType": "forecast"})["Item"]
+    assert "freshness_partition" not in item
+    item = status_table.get_item(Key={"site": "tst", "statusType": "device"})["Item"]
+    assert "freshness_partition" in item
@@ -1,7 +1,13 @@
 import time
+import pytest
 from helpers import _empty_strings_to_dash
 from helpers import add_item_timestamps
 from helpers import merge_dicts
+from helpers import parse_status_fields
+from helpers import build_projection_expression
+from helpers import filter_status_fields
+from helpers import flatten_status
+from helpers import combine_status_entries
 
 
 def test_empty_strings_to_dash():
@@ -90,3 +96,123 @@ def test_merge_dicts():
     assert c["mount"]["mount_instance_1"]["mount_key_4"]["key4.1"] == 41
     assert c["mount"]["mount_instance_1"]["mount_key_4"]["key4.2"] == 42
     assert c["mount"]["mount_instance_1"]["mount_key_4"]["key4.3"] == 43
+
+
+def test_parse_status_fields():
+    field_paths = parse_status_fields("enclosure.*.shutter_status, mount.mount1.ra,,")
+    assert field_paths == [["enclosure", "*", "shutter_status"], ["mount", "mount1", "ra"]]
+    assert parse_status_fields("") == []
+    assert parse_status_fields(None) == []
+
+
+@pytest.mark.parametrize("fields", ["mount..ra", "mount.", ".mount", "mount. .ra", ",".join(["mount.mount1.ra"] * 51)])
+def test_parse_status_fields_invalid(fields):
+    with pytest.raises(ValueError):
+        parse_status_fields(fields)
+
+
+def test_build_projection_expression():
+    field_paths = [["enclosure", "*", "shutter_status"], ["enclosure", "enclosure1", "enclosure_mode"], ["mount", "mount1", "ra"]]
+    projection, names = build_projection_expression(field_paths, attributes=("site",))
+    resolved_paths = set()
+    for path in projection.split(", "):
+        resolved_paths.add(".".join(names[placeholder] for placeholder in path.split(".")))
+    # The enclosure1 path is nested in the wildcard's enclosure path, so it shouldn't be projected separately
+    assert resolved_paths == {"site", "status.enclosure", "status.mount.mount1.ra"}
+
+
+def test_filter_status_fields():
+    status = {
+        "enclosure": {
+            "enclosure1": {"shutter_status": "Open", "enclosure_mode": "Auto"},
+            "enclosure2": {"shutter_status": "Closed"},
+        },
+        "mount": {
+            "mount1": {"ra": 1, "dec": 2},
+        },
+        "camera": {
+            "camera1": {"activity": "idle"},
+        },
+    }
+    filtered = filter_status_fields(status, [["enclosure", "*", "shutter_status"], ["mount", "mount1", "ra"], ["focuser", "*"]])
+    assert filtered == {
+        "enclosure": {
+            "enclosure1": {"shutter_status": "Open"},
+            "enclosure2": {"shutter_status": "Closed"},
+        },
+        "mount": {
+            "mount1": {"ra": 1},
+        },
+    }
+    assert status["enclosure"]["enclosure1"]["enclosure_mode"] == "Auto"
+
+
+def test_flatten_status():
+    status = add_item_timestamps({"mount": {"mount1": {"ra": 1, "dec": 2}}}, 12345)
+    status["forecast"] = [{"utc_long_form": "2023-01-01T00:00:00Z"}]
+    assert flatten_status(status) == {
+        "mount": {"mount1": {"ra": 1, "dec": 2}},
+        "forecast": [{"utc_long_form": "2023-01-01T00:00:00Z"}],
+    }
+
+
+def test_combine_status_entries():
+    weather = {
+        "statusType": "weather",
+        "server_timestamp_ms": 200,
+        "status": {
+            "observing_conditions": {"oc1": {"wx_ok": {"val": "Yes", "timestamp": 200}}},
+            "enclosure": {"enclosure1": {"shutter_status": {"val": "Closed", "timestamp": 200}}},
+        },
+    }
+    enclosure = {
+        "statusType": "enclosure",
+        "server_timestamp_ms": 300,
+        "status": {
+            "enclosure": {"enclosure1": {
+                "shutter_status": {"val": "Open", "timestamp": 100},
+                "enclosure_mode": {"val": "Auto", "timestamp": 300},
+            }},
+        },
+    }
+    combined_status, status_sources = combine_status_entries([weather, enclosure])
+    # The older shutter_status from the enclosure entry shouldn't overwrite the newer one
+    assert combined_status["enclosure"]["enclosure1"]["shutter_status"]["val"] == "Closed"
+    assert combined_status["enclosure"]["enclosure1"]["enclosure_mode"]["val"] == "Auto"
+    assert combined_status["observing_conditions"]["oc1"]["wx_ok"]["val"] == "Yes"
+    assert status_sources == {"observing_conditions": ["weather"], "enclosure": ["enclosure", "weather"]}
+    # The original entries are left unchanged
+    assert "enclosure_mode" not in weather["status"]["enclosure"]["enclosure1"]
+
+    # The result doesn't depend on the order of the entries
+    reversed_status, _ = combine_status_entries([enclosure, weather])
+    assert reversed_status == combined_status
+
+
+def test_combine_status_entries_equal_timestamps():
+    device = {
+        "statusType": "device",
+        "server_timestamp_ms": 100,
+        "status": {"mount": {"mount1": {"ra": {"val": 1, "timestamp": 100}}}},
+    }
+    enclosure = {
+        "statusType": "enclosure",
+        "server_timestamp_ms": 100,
+        "status": {"mount": {"mount1": {"ra": {"val": 2, "timestamp": 100}}}},
+    }
+    combined_status, status_sources = combine_status_entries([device, enclosure])
+    reversed_status, reversed_sources = combine_status_entries([enclosure, device])
+    assert combined_status == reversed_status
+    assert status_sources == reversed_sources
+    # Ties go to the greater statusType
+    assert combined_status["mount"]["mount1"]["ra"]["val"] == 2
+
+
+def test_combine_status_entries_untimestamped_values():
+    # Values without their own timestamp use the server_timestamp_ms of the entry they came from
+    a = {"statusType": "a", "server_timestamp_ms": 100, "status": {"x": {"i": {"k": "A-old"}}}}
+    b = {"statusType": "b", "server_timestamp_ms": 300, "status": {"x": {"i": {"other": "B"}}}}
+    c = {"statusType": "c", "server_timestamp_ms": 200, "status": {"x": {"i": {"k": "C-newer"}}}}
+    combined_status, status_sources = combine_status_entries([a, b, c])
+    assert combined_status == {"x": {"i": {"k": "C-newer", "other": "B"}}}
+    assert status_sources == {"x": ["a", "b", "c"]}
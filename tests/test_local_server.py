@@ -0,0 +1,128 @@
+import asyncio, json, re
+import pytest
+
+# PyYAML is only needed for local development, so it isn't in requirements.txt
+pytest.importorskip("yaml")
+
+from local_server import LocalServer, Route, get_routes, load_serverless_config, _reason_phrase
+
+
+@pytest.fixture
+def server():
+    return LocalServer(get_routes(load_serverless_config()), "dev", max_workers=1)
+
+
+def test_route_match():
+    route = Route("get", "/{site}/{status_type}", "handler.get_site_status")
+    assert route.method == "GET"
+    assert route.match(["tst", "weather"]) == {"site": "tst", "status_type": "weather"}
+    assert route.match(["tst"]) is None
+    assert Route("get", "/phase_status/{site}", "phase_status.get_phase_status").match(["tst", "weather"]) is None
+
+
+def test_route_specificity():
+    static_route = Route("get", "/{site}/complete_status", "handler.get_site_complete_status")
+    param_route = Route("get", "/{site}/{status_type}", "handler.get_site_status")
+    assert static_route.specificity < param_route.specificity
+
+
+def test_get_routes():
+    routes = get_routes(load_serverless_config())
+    assert ("GET", "/{site}/complete_status", "handler.get_site_complete_status") in \
+        [(r.method, r.path, r.handler) for r in routes]
+    # Only http events are routes, so the stream and scheduled functions aren't included
+    assert "handler.stream_handler" not in [r.handler for r in routes]
+
+
+@pytest.mark.parametrize("method, path, handler, path_parameters", [
+    ("GET", "/dev/tst/complete_status", "handler.get_site_complete_status", {"site": "tst"}),
+    ("GET", "/dev/tst/clear_all_status", "handler.clear_all_site_status", {"site": "tst"}),
+    ("GET", "/dev/tst/weather", "handler.get_site_status", {"site": "tst", "status_type": "weather"}),
+    ("GET", "/dev/phase_status/tst", "phase_status.get_phase_status", {"site": "tst"}),
+    ("GET", "/dev/allopenstatus", "handler.get_all_site_open_status", {}),
+    ("POST", "/dev/tst/status", "handler.post_status_http", {"site": "tst"}),
+    ("POST", "/dev/phase_status", "phase_status.post_phase_status", {}),
+    ("GET", "/tst/complete_status", "handler.get_site_complete_status", {"site": "tst"}),
+    ("GET", "/dev/my%20site/weather", "handler.get_site_status", {"site": "my site", "status_type": "weather"}),
+])
+def test_find_route(server, method, path, handler, path_parameters):
+    route, found_path_parameters = server.find_route(method, path)
+    assert route.handler == handler
+    assert found_path_parameters == path_parameters
+
+
+def test_find_route_not_found(server):
+    assert server.find_route("GET", "/dev/a/b/c") == (None, None)
+    assert server.find_route("DELETE", "/dev/tst/status") == (None, None)
+
+
+def test_build_event(server):
+    route, path_parameters = server.find_route("GET", "/dev/allopenstatus")
+    event = server.build_event("GET", route, "/dev/allopenstatus", path_parameters, "", {}, b"")
+    assert event["pathParameters"] is None
+    assert event["queryStringParameters"] is None
+    assert event["body"] is None
+
+    route, path_parameters = server.find_route("POST", "/dev/tst/status")
+    event = server.build_event("POST", route, "/dev/tst/status", path_parameters, "fields=a.b&flat=true", {}, b'{"a": 1}')
+    assert event["resource"] == "/{site}/status"
+    assert event["pathParameters"] == {"site": "tst"}
+    assert event["queryStringParameters"] == {"fields": "a.b", "flat": "true"}
+    assert event["body"] == '{"a": 1}'
+
+
+def test_reason_phrase():
+    assert _reason_phrase(401) == "Unauthorized"
+    assert _reason_phrase(500) == "Internal Server Error"
+    assert _reason_phrase(599) == ""
+
+
+def echo_handler(event, context):
+    return {"statusCode": 200, "headers": {}, "body": json.dumps({"site": event["pathParameters"]["site"], "body": event["body"]})}
+
+
+async def send_requests(requests):
+    """Send raw requests to a LocalServer over a real socket and return everything it sends back."""
+    route = Route("post", "/{site}/status", "handler.post_status_http")
+    route._handler_function = echo_handler
+    local_server = LocalServer([route], "dev", max_workers=1)
+    server = await asyncio.start_server(local_server.handle_connection, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    async with server:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        responses = []
+        for request, expect_continue in requests:
+            if expect_continue:
+                head, body = request.split(b"\r\n\r\n", 1)
+                writer.write(head + b"\r\n\r\n")
+                await writer.drain()
+                responses.append(await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=1))
+                writer.write(body)
+            else:
+                writer.write(request)
+            await writer.drain()
+            response_head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=1)
+            content_length = int(re.search(rb"Content-Length: (\d+)", response_head).group(1))
+            responses.append(response_head + await reader.readexactly(content_length))
+        writer.close()
+    return responses
+
+
+def test_handle_connection_keep_alive_chunked_and_expect_continue():
+    body = json.dumps({"statusType": "device", "status": {"mount": {"mount1": {"ra": "x" * 2000}}}}).encode()
+    chunked_body = b"".join(b"%x\r\n%s\r\n" % (len(body[i:i + 500]), body[i:i + 500]) for i in range(0, len(body), 500))
+    requests = [
+        (b"POST /dev/tst/status HTTP/1.1\r\nHost: localhost\r\nContent-Length: %d\r\n\r\n%s" % (len(body), body), False),
+        (b"POST /dev/sro/status HTTP/1.1\r\nHost: localhost\r\nTransfer-Encoding: chunked\r\n\r\n"
+         + chunked_body + b"0\r\n\r\n", False),
+        (b"POST /dev/mrc/status HTTP/1.1\r\nHost: localhost\r\nExpect: 100-continue\r\nContent-Length: %d\r\n\r\n%s"
+         % (len(body), body), True),
+    ]
+    responses = asyncio.run(send_requests(requests))
+
+    assert responses[2].startswith(b"HTTP/1.1 100 Continue")
+    echoed = [responses[0], responses[1], responses[3]]
+    for response, site in zip(echoed, ["tst", "sro", "mrc"]):
+        assert response.startswith(b"HTTP/1.1 200 OK")
+        response_body = json.loads(response.split(b"\r\n\r\n", 1)[1])
+        assert response_body == {"site": site, "body": body.decode()}
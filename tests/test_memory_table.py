@@ -0,0 +1,90 @@
+import decimal
+import pytest
+from boto3.dynamodb.conditions import Attr, Key
+from botocore.exceptions import ClientError
+from memory_table import MemoryTable
+
+
+def make_status_table():
+    table = MemoryTable("photonranch-status-test", "site", "statusType",
+                        {"freshness-index": ("freshness_partition", "server_timestamp_ms")})
+    table.put_item(Item={"site": "tst", "statusType": "weather", "server_timestamp_ms": 100, "freshness_partition": "active"})
+    table.put_item(Item={"site": "tst", "statusType": "device", "server_timestamp_ms": 300, "freshness_partition": "active"})
+    table.put_item(Item={"site": "sro", "statusType": "weather", "server_timestamp_ms": 200})
+    return table
+
+
+def test_get_put_delete_item():
+    table = make_status_table()
+    item = table.get_item(Key={"site": "tst", "statusType": "weather"})["Item"]
+    assert item["server_timestamp_ms"] == 100
+    assert isinstance(item["server_timestamp_ms"], decimal.Decimal)
+
+    table.delete_item(Key={"site": "tst", "statusType": "weather"})
+    assert table.get_item(Key={"site": "tst", "statusType": "weather"}) == {}
+
+
+def test_put_item_rejects_floats():
+    table = make_status_table()
+    with pytest.raises(TypeError):
+        table.put_item(Item={"site": "tst", "statusType": "weather", "temp": 1.5})
+
+
+def test_scan_with_filter_expression():
+    table = make_status_table()
+    items = table.scan(FilterExpression=Attr('site').eq('tst'))["Items"]
+    assert sorted(item["statusType"] for item in items) == ["device", "weather"]
+
+
+def test_query_sparse_index():
+    table = make_status_table()
+    items = table.query(
+        IndexName="freshness-index",
+        KeyConditionExpression=Key('freshness_partition').eq('active') & Key('server_timestamp_ms').lt(1000),
+        ScanIndexForward=False,
+    )["Items"]
+    # The sro entry has no freshness_partition, so it isn't in the index
+    assert [item["statusType"] for item in items] == ["device", "weather"]
+    assert "server_timestamp_ms" in items[0] and "freshness_partition" in items[0]
+
+
+def test_conditional_update_item():
+    table = make_status_table()
+    key = {"site": "tst", "statusType": "weather"}
+    update_args = {
+        "Key": key,
+        "UpdateExpression": "SET stale = :stale REMOVE freshness_partition",
+        "ConditionExpression": "server_timestamp_ms = :ts",
+    }
+    with pytest.raises(ClientError):
+        table.update_item(ExpressionAttributeValues={":stale": True, ":ts": 99}, **update_args)
+
+    table.update_item(ExpressionAttributeValues={":stale": True, ":ts": 100}, **update_args)
+    item = table.get_item(Key=key)["Item"]
+    assert item["stale"] is True
+    assert "freshness_partition" not in item
+
+
+def test_get_item_with_projection_expression():
+    table = MemoryTable("photonranch-status-test", "site", "statusType")
+    table.put_item(Item={"site": "tst", "statusType": "device", "status": {"mount": {"mount1": {"ra": 1, "dec": 2}}}})
+    item = table.get_item(
+        Key={"site": "tst", "statusType": "device"},
+        ProjectionExpression="#f0, #f1.#f2.#f3.#f4",
+        ExpressionAttributeNames={"#f0": "site", "#f1": "status", "#f2": "mount", "#f3": "mount1", "#f4": "ra"},
+    )["Item"]
+    assert item == {"site": "tst", "status": {"mount": {"mount1": {"ra": 1}}}}
+
+
+def test_query_pagination():
+    table = make_status_table()
+    query_args = {
+        "IndexName": "freshness-index",
+        "KeyConditionExpression": Key('freshness_partition').eq('active') & Key('server_timestamp_ms').lt(1000),
+        "Limit": 1,
+    }
+    first_page = table.query(**query_args)
+    assert [item["statusType"] for item in first_page["Items"]] == ["weather"]
+    second_page = table.query(ExclusiveStartKey=first_page["LastEvaluatedKey"], **query_args)
+    assert [item["statusType"] for item in second_page["Items"]] == ["device"]
+    assert "LastEvaluatedKey" not in second_page
@@ -0,0 +1,107 @@
+import time
+import pytest
+import stale_status
+from helpers import FRESHNESS_PARTITION
+
+
+class TableWrapper:
+    """Passes all calls through to the wrapped table, so subclasses can override single methods."""
+
+    def __init__(self, table):
+        self.table = table
+
+    def __getattr__(self, name):
+        return getattr(self.table, name)
+
+
+class PagedTable(TableWrapper):
+    """Wraps a MemoryTable so that every query returns one item per page."""
+
+    def query(self, **kwargs):
+        return self.table.query(Limit=1, **kwargs)
+
+
+class RacingTable(TableWrapper):
+    """Wraps a MemoryTable so that a site posts a new status right after the freshness index is queried."""
+
+    def __init__(self, table, site, status_type):
+        super().__init__(table)
+        self.updated_entry = (site, status_type)
+
+    def query(self, **kwargs):
+        response = self.table.query(**kwargs)
+        put_status_entry(self.table, *self.updated_entry, age_s=0)
+        return response
+
+
+def put_status_entry(table, site, status_type, age_s):
+    table.put_item(Item={
+        "site": site,
+        "statusType": status_type,
+        "status": {},
+        "server_timestamp_ms": int((time.time() - age_s) * 1000),
+        "freshness_partition": FRESHNESS_PARTITION,
+    })
+
+
+@pytest.fixture(autouse=True)
+def stale_threshold(monkeypatch):
+    monkeypatch.setenv("STALE_STATUS_THRESHOLD_S", "600")
+
+
+def stale_status_messages(datastream):
+    return [(site, data) for site, data, topic in datastream.messages if topic == "stale_status"]
+
+
+def test_sweep_marks_only_old_entries_stale(status_table, datastream):
+    put_status_entry(status_table, "tst", "weather", age_s=3600)
+    put_status_entry(status_table, "tst", "device", age_s=10)
+
+    stale_status.sweep_stale_status({}, {})
+
+    old_entry = status_table.get_item(Key={"site": "tst", "statusType": "weather"})["Item"]
+    new_entry = status_table.get_item(Key={"site": "tst", "statusType": "device"})["Item"]
+    assert old_entry["stale"] is True
+    assert "freshness_partition" not in old_entry
+    assert "stale" not in new_entry
+    assert new_entry["freshness_partition"] == FRESHNESS_PARTITION
+
+    # All newly stale entries are sent in a single datastream message
+    messages = stale_status_messages(datastream)
+    assert len(messages) == 1
+    site, payload = messages[0]
+    assert site == "all"
+    assert payload["threshold_s"] == 600
+    assert [(s["site"], s["statusType"]) for s in payload["stale_status"]] == [("tst", "weather")]
+
+
+def test_second_sweep_sends_nothing(status_table, datastream):
+    put_status_entry(status_table, "tst", "weather", age_s=3600)
+    stale_status.sweep_stale_status({}, {})
+    stale_status.sweep_stale_status({}, {})
+    assert len(stale_status_messages(datastream)) == 1
+
+
+def test_all_pages_of_stale_entries_are_swept(status_table, datastream, monkeypatch):
+    for site in ["tst", "sro", "mrc"]:
+        put_status_entry(status_table, site, "weather", age_s=3600)
+    monkeypatch.setattr(stale_status, "status_table", PagedTable(status_table))
+
+    stale_status.sweep_stale_status({}, {})
+
+    _, payload = stale_status_messages(datastream)[0]
+    assert sorted(s["site"] for s in payload["stale_status"]) == ["mrc", "sro", "tst"]
+
+
+def test_entry_updated_after_query_is_not_marked_stale(status_table, datastream, monkeypatch):
+    put_status_entry(status_table, "tst", "weather", age_s=3600)
+    put_status_entry(status_table, "sro", "weather", age_s=3600)
+    monkeypatch.setattr(stale_status, "status_table", RacingTable(status_table, "tst", "weather"))
+
+    stale_status.sweep_stale_status({}, {})
+
+    updated_entry = status_table.get_item(Key={"site": "tst", "statusType": "weather"})["Item"]
+    assert "stale" not in updated_entry
+    assert updated_entry["freshness_partition"] == FRESHNESS_PARTITION
+    _, payload = stale_status_messages(datastream)[0]
+    assert [s["site"] for s in payload["stale_status"]] == ["sro"]
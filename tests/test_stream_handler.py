@@ -0,0 +1,110 @@
+import pytest
+import handler
+from stream_events import make_stream_batch, make_stream_record, failed_sequence_numbers
+
+pytestmark = pytest.mark.usefixtures("stream_checkpoint_table")
+
+
+def test_all_records_sent_in_order(datastream):
+    event = make_stream_batch([
+        ("tst", "weather", 1), ("sro", "device", 1), ("tst", "device", 2), ("tst", "weather", 3),
+    ])
+    response = handler.stream_handler(event, {})
+    assert failed_sequence_numbers(response) == []
+    assert datastream.sent_for("tst") == [("weather", 1), ("device", 2), ("weather", 3)]
+    assert datastream.sent_for("sro") == [("device", 1)]
+
+
+def test_partial_failure_reports_only_failed_site_records(datastream):
+    datastream.fail_on = {("tst", 2): 1}
+    event = make_stream_batch([
+        ("tst", "weather", 1), ("sro", "device", 1), ("tst", "device", 2), ("tst", "weather", 3), ("sro", "device", 2),
+    ])
+    response = handler.stream_handler(event, {})
+
+    # The failed tst record and the tst record after it are retried; sro is unaffected
+    assert failed_sequence_numbers(response) == ["102", "103"]
+    assert datastream.sent_for("tst") == [("weather", 1)]
+    assert datastream.sent_for("sro") == [("device", 1), ("device", 2)]
+
+    # Lambda retries from the first failed record, which replays the later sro record as well
+    retry = {"Records": event["Records"][2:]}
+    response = handler.stream_handler(retry, {})
+    assert failed_sequence_numbers(response) == []
+    assert datastream.sent_for("tst") == [("weather", 1), ("device", 2), ("weather", 3)]
+    assert datastream.sent_for("sro") == [("device", 1), ("device", 2)]
+
+
+def test_replayed_batch_is_not_sent_twice(datastream):
+    event = make_stream_batch([("tst", "weather", 1), ("tst", "weather", 2)])
+    handler.stream_handler(event, {})
+    handler.stream_handler(event, {})
+    assert datastream.sent_for("tst") == [("weather", 1), ("weather", 2)]
+
+
+def test_older_status_not_sent_after_newer(datastream):
+    handler.stream_handler(make_stream_batch([("tst", "weather", 5)], first_sequence_number=200), {})
+    handler.stream_handler(make_stream_batch([("tst", "weather", 4)], first_sequence_number=300), {})
+    assert datastream.sent_for("tst") == [("weather", 5)]
+
+
+def test_stale_marked_records_are_not_sent(datastream):
+    # The stale status sweeper's update doesn't change server_timestamp_ms, and is reported in its own alert
+    event = {"Records": [
+        make_stream_record("tst", "weather", 5, 200),
+        make_stream_record("tst", "weather", 5, 201, stale=True),
+    ]}
+    response = handler.stream_handler(event, {})
+    assert failed_sequence_numbers(response) == []
+    assert datastream.sent_for("tst") == [("weather", 5)]
+
+
+def test_remove_records_are_skipped(datastream):
+    event = {"Records": [
+        make_stream_record("tst", "weather", 1, 100, event_name="REMOVE"),
+        make_stream_record("tst", "device", 2, 101),
+    ]}
+    response = handler.stream_handler(event, {})
+    assert failed_sequence_numbers(response) == []
+    assert datastream.sent_for("tst") == [("device", 2)]
+
+
+def test_retry_on_new_container_does_not_resend_older_status(datastream, monkeypatch):
+    datastream.fail_on = {("sro", 1): 1}
+    event = make_stream_batch([
+        ("tst", "weather", 1), ("tst", "weather", 2), ("sro", "device", 1), ("tst", "weather", 3),
+    ])
+    response = handler.stream_handler(event, {})
+    assert failed_sequence_numbers(response) == ["102"]
+
+    # The retry runs in a fresh container without the in memory checkpoints, and replays from the failed record
+    monkeypatch.setattr(handler, "last_sent_status", {})
+    retry = {"Records": event["Records"][1:]}
+    response = handler.stream_handler(retry, {})
+    assert failed_sequence_numbers(response) == []
+    assert datastream.sent_for("tst") == [("weather", 1), ("weather", 2), ("weather", 3)]
+    assert datastream.sent_for("sro") == [("device", 1)]
+
+
+def test_checkpoint_is_not_moved_backwards(datastream):
+    handler.stream_handler(make_stream_batch([("tst", "weather", 5)], first_sequence_number=200), {})
+    handler._save_stream_checkpoint(("tst", "weather"), (4, 150))
+    checkpoint = handler.stream_checkpoint_table.get_item(Key={"site": "tst", "statusType": "weather"})["Item"]
+    assert (checkpoint["server_timestamp_ms"], checkpoint["sequence_number"]) == (5, 200)
+
+
+def test_freshness_partition_is_not_sent(datastream):
+    handler.stream_handler(make_stream_batch([("tst", "weather", 1)]), {})
+    _, data, _ = datastream.messages[0]
+    assert "freshness_partition" not in data
+
+
+def test_checkpoint_table_is_only_read_on_a_cold_cache(datastream, monkeypatch):
+    reads = []
+    get_item = handler.stream_checkpoint_table.get_item
+    monkeypatch.setattr(handler.stream_checkpoint_table, "get_item", lambda **kwargs: reads.append(kwargs) or get_item(**kwargs))
+
+    handler.stream_handler(make_stream_batch([("tst", "weather", 1), ("tst", "weather", 2)]), {})
+    handler.stream_handler(make_stream_batch([("tst", "weather", 3)], first_sequence_number=200), {})
+    assert len(reads) == 1
+    assert datastream.sent_for("tst") == [("weather", 1), ("weather", 2), ("weather", 3)]